@@ -0,0 +1,35 @@
+"""Organization_name_normalized
+
+Revision ID: 3f9c2a7d1e84
+Revises: debbef955c53
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c2a7d1e84'
+down_revision: Union[str, None] = 'debbef955c53'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# копия app.core.text.NAME_NORMALIZED_SQL на момент этой ревизии: правки в приложении не меняют миграцию
+NAME_NORMALIZED_SQL = (
+    "btrim(regexp_replace(translate(lower(name), "
+    "'ёйàáâãäåāçćčèéêëēěìíîïīłñńňòóôõöøōřśšùúûüūůýÿźżž', "
+    "'еиaaaaaaaccceeeeeeiiiiilnnnooooooorssuuuuuuyyzzz'), '\\s+', ' ', 'g'))"
+)
+
+
+def upgrade() -> None:
+    # generated column: существующие строки база считает сама при ADD COLUMN, без выборки в питон
+    op.add_column('organizations', sa.Column('name_normalized', sa.String(collation='C'), sa.Computed(NAME_NORMALIZED_SQL, persisted=True), nullable=False))
+    op.create_index(op.f('ix_organizations_name_normalized'), 'organizations', ['name_normalized'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_organizations_name_normalized'), table_name='organizations')
+    op.drop_column('organizations', 'name_normalized')
@@ -0,0 +1,31 @@
+"""Organization_phones_number_digits
+
+Revision ID: 8b41e6c0f2a9
+Revises: 3f9c2a7d1e84
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b41e6c0f2a9'
+down_revision: Union[str, None] = '3f9c2a7d1e84'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # то же, что normalize_phone: оставляем только 0-9; generated column заполняется и для существующих строк
+    op.add_column('organization_phones', sa.Column('number_digits', sa.String(collation='C'), sa.Computed("regexp_replace(number, '[^0-9]', '', 'g')", persisted=True), nullable=False))
+    op.create_index(op.f('ix_organization_phones_number_digits'), 'organization_phones', ['number_digits'], unique=False)
+    op.create_index('ix_organization_phones_number_digits_reversed', 'organization_phones', [sa.text('reverse(number_digits)')], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_organization_phones_number_digits_reversed', table_name='organization_phones')
+    op.drop_index(op.f('ix_organization_phones_number_digits'), table_name='organization_phones')
+    op.drop_column('organization_phones', 'number_digits')
@@ -0,0 +1,148 @@
+"""Organization_read_model
+
+Revision ID: debbef955c53
+Revises: dd17182de222
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'debbef955c53'
+down_revision: Union[str, None] = 'dd17182de222'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# функции и триггеры модели чтения на момент этой ревизии (app/db/read_model.py может меняться дальше)
+REFRESH_FUNCTION = """
+CREATE OR REPLACE FUNCTION refresh_organization_read_model(org_ids integer[]) RETURNS void AS $$
+BEGIN
+    -- org_ids = NULL - пересчитать все организации
+    INSERT INTO organization_read_model (
+        organization_id, name, building_id, address, latitude, longitude, document, activity_ancestor_ids
+    )
+    SELECT
+        o.id, o.name, b.id, b.address, b.latitude, b.longitude,
+        jsonb_build_object(
+            'activities', COALESCE((
+                SELECT jsonb_agg(jsonb_build_object('id', a.id, 'name', a.name, 'parent_id', a.parent_id) ORDER BY a.id)
+                FROM organization_activity oa JOIN activities a ON a.id = oa.activity_id
+                WHERE oa.organization_id = o.id
+            ), CAST('[]' AS jsonb)),
+            'phones', COALESCE((
+                SELECT jsonb_agg(jsonb_build_object('id', p.id, 'number', p.number) ORDER BY p.id)
+                FROM organization_phones p
+                WHERE p.organization_id = o.id
+            ), CAST('[]' AS jsonb))
+        ),
+        -- категории организации вместе со всеми предками: фильтр по категории = одно @> по GIN
+        COALESCE((
+            WITH RECURSIVE up(id, parent_id) AS (
+                SELECT a.id, a.parent_id
+                FROM organization_activity oa JOIN activities a ON a.id = oa.activity_id
+                WHERE oa.organization_id = o.id
+                UNION
+                SELECT p.id, p.parent_id FROM activities p JOIN up ON p.id = up.parent_id
+            )
+            SELECT array_agg(id ORDER BY id) FROM up
+        ), CAST('{}' AS integer[]))
+    FROM organizations o JOIN buildings b ON b.id = o.building_id
+    WHERE org_ids IS NULL OR o.id = ANY(org_ids)
+    ON CONFLICT (organization_id) DO UPDATE SET
+        name = EXCLUDED.name,
+        building_id = EXCLUDED.building_id,
+        address = EXCLUDED.address,
+        latitude = EXCLUDED.latitude,
+        longitude = EXCLUDED.longitude,
+        document = EXCLUDED.document,
+        activity_ancestor_ids = EXCLUDED.activity_ancestor_ids;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+SYNC_FUNCTION = """
+CREATE OR REPLACE FUNCTION sync_organization_read_model() RETURNS trigger AS $$
+BEGIN
+    -- удаление организации чистит модель через ON DELETE CASCADE
+    IF TG_TABLE_NAME = 'organizations' THEN
+        PERFORM refresh_organization_read_model(ARRAY[NEW.id]);
+    ELSIF TG_TABLE_NAME = 'buildings' THEN
+        PERFORM refresh_organization_read_model(ARRAY(SELECT id FROM organizations WHERE building_id = NEW.id));
+    ELSIF TG_TABLE_NAME = 'activities' THEN
+        -- переименование или перенос категории меняет документ и предков у всего поддерева
+        PERFORM refresh_organization_read_model(ARRAY(
+            WITH RECURSIVE down(id) AS (
+                SELECT NEW.id
+                UNION
+                SELECT a.id FROM activities a JOIN down ON a.parent_id = down.id
+            )
+            SELECT DISTINCT oa.organization_id FROM organization_activity oa JOIN down ON oa.activity_id = down.id
+        ));
+    ELSE
+        -- organization_activity, organization_phones
+        IF TG_OP <> 'INSERT' THEN
+            PERFORM refresh_organization_read_model(ARRAY[OLD.organization_id]);
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            PERFORM refresh_organization_read_model(ARRAY[NEW.organization_id]);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+TRIGGER_TABLES = {
+    'organizations': 'INSERT OR UPDATE',
+    'buildings': 'UPDATE',
+    'activities': 'UPDATE',
+    'organization_activity': 'INSERT OR UPDATE OR DELETE',
+    'organization_phones': 'INSERT OR UPDATE OR DELETE',
+}
+
+
+def upgrade() -> None:
+    op.create_table('organization_read_model',
+    sa.Column('organization_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('building_id', sa.Integer(), nullable=False),
+    sa.Column('address', sa.String(), nullable=False),
+    sa.Column('latitude', sa.Float(), nullable=False),
+    sa.Column('longitude', sa.Float(), nullable=False),
+    sa.Column('document', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('activity_ancestor_ids', postgresql.ARRAY(sa.Integer()), nullable=False),
+    sa.ForeignKeyConstraint(['organization_id'], ['organizations.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('organization_id')
+    )
+    op.create_index(op.f('ix_organization_read_model_name'), 'organization_read_model', ['name'], unique=False)
+    op.create_index(op.f('ix_organization_read_model_building_id'), 'organization_read_model', ['building_id'], unique=False)
+    op.create_index('ix_organization_read_model_coords', 'organization_read_model', ['latitude', 'longitude'], unique=False)
+    op.create_index('ix_organization_read_model_activity_ancestor_ids', 'organization_read_model', ['activity_ancestor_ids'], unique=False, postgresql_using='gin')
+
+    op.execute(REFRESH_FUNCTION)
+    op.execute(SYNC_FUNCTION)
+    for table, events in TRIGGER_TABLES.items():
+        op.execute(
+            f"CREATE TRIGGER trg_sync_organization_read_model AFTER {events} ON {table} "
+            f"FOR EACH ROW EXECUTE FUNCTION sync_organization_read_model()"
+        )
+
+    # заполняем по уже существующим данным
+    op.execute("SELECT refresh_organization_read_model(NULL)")
+
+
+def downgrade() -> None:
+    for table in TRIGGER_TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS trg_sync_organization_read_model ON {table}")
+    op.execute("DROP FUNCTION IF EXISTS sync_organization_read_model()")
+    op.execute("DROP FUNCTION IF EXISTS refresh_organization_read_model(integer[])")
+
+    op.drop_index('ix_organization_read_model_activity_ancestor_ids', table_name='organization_read_model')
+    op.drop_index('ix_organization_read_model_coords', table_name='organization_read_model')
+    op.drop_index(op.f('ix_organization_read_model_building_id'), table_name='organization_read_model')
+    op.drop_index(op.f('ix_organization_read_model_name'), table_name='organization_read_model')
+    op.drop_table('organization_read_model')
@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends, HTTPException, Security
+from fastapi.security import APIKeyHeader
+
+from app.core.config import settings
+from app.core.profiling import profile_store
+
+admin_key_header = APIKeyHeader(name="X-Admin-Key", auto_error=False)
+
+async def get_admin_key(admin_key_header: str = Security(admin_key_header)):
+    # без ADMIN_API_KEY админка закрыта
+    if settings.ADMIN_API_KEY and admin_key_header == settings.ADMIN_API_KEY:
+        return admin_key_header
+    raise HTTPException(status_code=403, detail="Could not validate credentials")
+
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(get_admin_key)])
+
+@router.get("/profiles")
+async def list_profiles():
+    return profile_store.summaries()
+
+@router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    report = profile_store.get(profile_id)
+    if not report:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return report
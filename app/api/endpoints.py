@@ -1,30 +1,155 @@
-from fastapi import APIRouter, Depends, HTTPException, Security, Query
+import random
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Response, Security, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import APIKeyHeader
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import event, select, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import selectinload
-from typing import List, Optional
+from typing import List, Literal, Optional
 
-from app.db.session import get_db
+from app.api.negotiation import NegotiatedRoute
+from app.db.session import engine, get_db
+from app.core import admission
+from app.core.admission import Overloaded, retry_after_header
 from app.core.config import settings
-from app.models.orm import Organization, Activity, Building
-from app.schemas.all_schemas import OrganizationRead, BuildingRead
+from app.core.profiling import RequestProfile, profile_store
+from app.core.text import normalize_phone
+from app.models.orm import Organization, Building
+from app.schemas.all_schemas import OrganizationRead, OrganizationSuggestion, BuildingRead
+from app.services import read_model
+from app.services.export import ExportTable, stream_copy
 from app.services.business import (
-    get_activity_subtree_ids, 
+    get_organizations_by_activity,
     get_organizations_in_radius, 
     get_organizations_in_bbox,
     get_buildings_in_radius,
-    get_buildings_in_bbox
+    get_buildings_in_bbox,
+    get_organizations_by_phone,
+    suggest_organizations
 )
 
-router = APIRouter()
+# короче - слишком много совпадений по окончанию
+MIN_PHONE_SUFFIX_DIGITS = 4
 
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
 async def get_api_key(api_key_header: str = Security(api_key_header)):
-    if api_key_header == settings.API_KEY:
-        return api_key_header
-    raise HTTPException(status_code=403, detail="Could not validate credentials")
+    if api_key_header != settings.API_KEY:
+        raise HTTPException(status_code=403, detail="Could not validate credentials")
+
+    # лимит на ключ, чтобы один клиент не съел весь пул
+    wait = admission.rate_limiter.check(api_key_header)
+    if wait:
+        raise HTTPException(status_code=429, detail="Rate limit exceeded", headers=retry_after_header(wait))
+    return api_key_header
+
+# роуты, где вся работа с базой идет через single-flight (или в ExportResponse):
+# слот берется там, а склеенные ждущие чужого результата слот не занимают
+DEFERRED_ADMISSION_ROUTES = {
+    "get_organizations_by_activity",
+    "search_organizations_geo",
+    "search_buildings_geo",
+    "export_table",
+}
+
+async def admit_request(request: Request, _: str = Depends(get_api_key)):
+    # ограничиваем число одновременных запросов в БД, лишние сбрасываем сразу
+    lease = admission.DbLease(admission.db_limiter)
+    token = admission.current_lease.set(lease)
+    try:
+        if getattr(request.scope.get("route"), "name", None) not in DEFERRED_ADMISSION_ROUTES:
+            await lease.acquire()
+        yield
+    except Overloaded as exc:
+        raise HTTPException(status_code=503, detail="Server is overloaded", headers=retry_after_header(exc.retry_after))
+    finally:
+        lease.release()
+        admission.current_lease.reset(token)
+
+# sqlstate query_canceled: сработал statement_timeout
+QUERY_CANCELED = "57014"
+
+async def apply_statement_timeout(request: Request, session: AsyncSession = Depends(get_db)):
+    # SET LOCAL живет до конца транзакции, поэтому ставим его в начале каждой транзакции сессии
+    # через after_begin - соединение из пула берется только при первом реальном запросе
+    route = request.scope.get("route")
+    timeout_ms = int(settings.STATEMENT_TIMEOUTS.get(getattr(route, "name", None), settings.STATEMENT_TIMEOUT_MS))
+    statement = f"SET LOCAL statement_timeout = {timeout_ms}"
+
+    def set_timeout(_session, _transaction, connection):
+        connection.exec_driver_sql(statement)
+
+    if session.in_transaction():
+        await session.execute(text(statement))
+    event.listen(session.sync_session, "after_begin", set_timeout)
+    try:
+        yield
+    except DBAPIError as exc:
+        if getattr(exc.orig, "sqlstate", None) == QUERY_CANCELED:
+            raise HTTPException(status_code=504, detail="Query timed out")
+        raise
+    finally:
+        event.remove(session.sync_session, "after_begin", set_timeout)
+
+async def store_profile(profile: RequestProfile, request_info: dict) -> None:
+    # после отправки ответа: планы снимаем на своем соединении, сессия запроса уже закрыта
+    explain = "done"
+    try:
+        async with engine.connect() as connection:
+            await profile.explain(connection)
+    except Exception:
+        # отчет без планов все равно полезен, не оставляем его навсегда в pending
+        explain = "failed"
+    profile_store.add(profile.report(request_info, explain=explain))
+
+async def profile_request(
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    session: AsyncSession = Depends(get_db)
+):
+    # профиль по заголовку X-Profile (только с админским ключом)
+    # или автоматически для доли запросов, если они оказались медленнее PROFILE_SLOW_MS
+    requested = bool(
+        request.headers.get("X-Profile")
+        and settings.ADMIN_API_KEY
+        and request.headers.get("X-Admin-Key") == settings.ADMIN_API_KEY
+    )
+    if not requested and random.random() >= settings.PROFILE_SAMPLE_RATE:
+        yield
+        return
+
+    profile = RequestProfile(session, "header" if requested else "slow")
+    if requested:
+        response.headers["X-Profile-Id"] = profile.id
+
+    await profile.start()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        profile.stop()
+        if requested or profile.duration_ms >= settings.PROFILE_SLOW_MS:
+            request_info = {
+                "method": request.method,
+                "path": request.url.path,
+                "query": request.url.query,
+                "failed": failed,
+            }
+            # здесь ответ еще не отправлен: запросы и параметры уже записаны и отчет доступен сразу,
+            # а EXPLAIN ANALYZE (повторный прогон) - в фоне после ответа, отчет потом перезапишется
+            profile_store.add(profile.report(request_info, explain="skipped" if failed else "pending"))
+            if not failed:
+                background_tasks.add_task(store_profile, profile, request_info)
+
+router = APIRouter(
+    route_class=NegotiatedRoute,
+    dependencies=[Depends(admit_request), Depends(apply_statement_timeout), Depends(profile_request)],
+)
 
 
 @router.get("/buildings/{building_id}/organizations", response_model=List[OrganizationRead])
@@ -34,6 +159,9 @@ async def get_organizations_by_building(
     _: str = Depends(get_api_key)
 ):
     # список всех организаций в здании
+    if settings.READ_MODEL_ENABLED:
+        return await read_model.get_organizations_by_building(session, building_id)
+
     stmt = select(Organization).options(
         selectinload(Organization.building),
         selectinload(Organization.activities),
@@ -82,19 +210,14 @@ async def get_organizations_by_activity(
 ):
     # рекурсивный поиск по дереву категорий
     # если ищем "Еда", должны найти и "Мясо", и "Молоко"
-    activity_ids = await get_activity_subtree_ids(session, activity_id)
-    
-    if not activity_ids:
-        raise HTTPException(status_code=404, detail="Activity not found")
+    if settings.READ_MODEL_ENABLED:
+        organizations = await read_model.get_organizations_by_activity(session, activity_id)
+    else:
+        organizations = await get_organizations_by_activity(session, activity_id)
 
-    stmt = select(Organization).join(Organization.activities).options(
-        selectinload(Organization.building),
-        selectinload(Organization.activities),
-        selectinload(Organization.phones)
-    ).where(Activity.id.in_(activity_ids)).distinct()
-    
-    result = await session.execute(stmt)
-    return result.scalars().all()
+    if organizations is None:
+        raise HTTPException(status_code=404, detail="Activity not found")
+    return organizations
 
 @router.get("/organizations/search/geo", response_model=List[OrganizationRead])
 async def search_organizations_geo(
@@ -110,11 +233,16 @@ async def search_organizations_geo(
 ):
     # два режима поиска: радиус или квадрат
     # если передали точку и радиус - считаем расстояние
+    # с включенной моделью чтения - те же фильтры по одной таблице
     if lat is not None and lon is not None and radius is not None:
+        if settings.READ_MODEL_ENABLED:
+            return await read_model.get_organizations_in_radius(session, lat, lon, radius)
         return await get_organizations_in_radius(session, lat, lon, radius)
     
     # если передали границы - ищем в квадрате
     if all(v is not None for v in [min_lat, max_lat, min_lon, max_lon]):
+        if settings.READ_MODEL_ENABLED:
+            return await read_model.get_organizations_in_bbox(session, min_lat, max_lat, min_lon, max_lon)
         return await get_organizations_in_bbox(session, min_lat, max_lat, min_lon, max_lon)
         
     raise HTTPException(status_code=400, detail="Provide either (lat, lon, radius) or (min_lat, max_lat, min_lon, max_lon)")
@@ -126,6 +254,9 @@ async def search_organizations_by_name(
     _: str = Depends(get_api_key)
 ):
     # простой поиск по названию (ilike)
+    if settings.READ_MODEL_ENABLED:
+        return await read_model.search_organizations_by_name(session, q)
+
     stmt = select(Organization).options(
         selectinload(Organization.building),
         selectinload(Organization.activities),
@@ -135,12 +266,44 @@ async def search_organizations_by_name(
     result = await session.execute(stmt)
     return result.scalars().all()
 
+@router.get("/organizations/suggest", response_model=List[OrganizationSuggestion])
+async def suggest_organizations_by_prefix(
+    prefix: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    session: AsyncSession = Depends(get_db),
+    _: str = Depends(get_api_key)
+):
+    # автодополнение в строке поиска: дергается на каждое нажатие, поэтому без связей
+    return await suggest_organizations(session, prefix, limit)
+
+@router.get("/organizations/by-phone", response_model=List[OrganizationRead])
+async def get_organizations_by_phone_number(
+    number: str = Query(...),
+    match: Literal["exact", "suffix"] = Query("exact"),
+    session: AsyncSession = Depends(get_db),
+    _: str = Depends(get_api_key)
+):
+    # "чей это номер": сравниваем только цифры, формат записи не важен
+    digits = normalize_phone(number)
+    if not digits:
+        raise HTTPException(status_code=400, detail="Phone number must contain digits")
+    if match == "suffix" and len(digits) < MIN_PHONE_SUFFIX_DIGITS:
+        raise HTTPException(status_code=400, detail=f"Suffix match needs at least {MIN_PHONE_SUFFIX_DIGITS} digits")
+
+    return await get_organizations_by_phone(session, digits, suffix=match == "suffix")
+
 @router.get("/organizations/{organization_id}", response_model=OrganizationRead)
 async def get_organization_detail(
     organization_id: int,
     session: AsyncSession = Depends(get_db),
     _: str = Depends(get_api_key)
 ):
+    if settings.READ_MODEL_ENABLED:
+        org = await read_model.get_organization(session, organization_id)
+        if not org:
+            raise HTTPException(status_code=404, detail="Organization not found")
+        return org
+
     stmt = select(Organization).options(
         selectinload(Organization.building),
         selectinload(Organization.activities),
@@ -153,3 +316,38 @@ async def get_organization_detail(
     if not org:
         raise HTTPException(status_code=404, detail="Organization not found")
     return org
+
+class ExportResponse(StreamingResponse):
+    # тело стримится уже после выхода зависимостей (admit_request отпустил свой слот),
+    # поэтому слот БД берем заново и держим на все время выгрузки
+    async def __call__(self, scope, receive, send):
+        try:
+            async with admission.db_limiter.slot():
+                await super().__call__(scope, receive, send)
+        except Overloaded as exc:
+            # до начала ответа: клиенту еще можно честно ответить 503
+            response = JSONResponse(
+                {"detail": "Server is overloaded"}, status_code=503, headers=retry_after_header(exc.retry_after)
+            )
+            await response(scope, receive, send)
+
+@router.get("/export/{table}", response_class=ExportResponse)
+async def export_table(
+    table: ExportTable,
+    _: str = Depends(get_api_key)
+):
+    # выгрузка для аналитики: COPY TO STDOUT стримится клиенту chunked
+    # свое соединение, т.к. сессия из get_db закрывается до отправки тела
+    async def content():
+        async with engine.connect() as connection:
+            # выгрузка долгая по своей природе: statement_timeout явно выключен,
+            # нагрузку на базу ограничивает слот DB_MAX_CONCURRENCY (ExportResponse)
+            await connection.execute(text("SET LOCAL statement_timeout = 0"))
+            async for chunk in stream_copy(connection, table):
+                yield chunk
+
+    return ExportResponse(
+        content(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{table.value}.csv"'}
+    )
@@ -0,0 +1,167 @@
+import gzip
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple, get_args, get_origin
+
+import msgpack
+import zstandard
+from fastapi import Request, Response
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.routing import APIRoute
+from starlette.background import BackgroundTask
+
+from app.core.config import settings
+from app.schemas.all_schemas import OrganizationRead
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+# словарное (колоночное) кодирование: здания и категории один раз, организации ссылаются по id
+DICT_JSON = "application/vnd.directory.dict+json"
+DICT_MSGPACK = "application/vnd.directory.dict+msgpack"
+
+_zstd = zstandard.ZstdCompressor(level=3)
+
+
+def _columns(rows: List[Dict[str, Any]], fields: Tuple[str, ...]) -> Dict[str, List[Any]]:
+    return {field: [row[field] for row in rows] for field in fields}
+
+
+def dictionary_encode(content: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # только для списков организаций (NegotiatedRoute предлагает формат лишь на таких роутах)
+    buildings: Dict[int, Dict[str, Any]] = {}
+    activities: Dict[int, Dict[str, Any]] = {}
+    organizations = []
+    for org in content:
+        building = org["building"]
+        buildings.setdefault(building["id"], building)
+        for activity in org["activities"]:
+            activities.setdefault(activity["id"], activity)
+        organizations.append({
+            "id": org["id"],
+            "name": org["name"],
+            "building_id": org["building_id"],
+            "activity_ids": [activity["id"] for activity in org["activities"]],
+            "phone_ids": [phone["id"] for phone in org["phones"]],
+            "phones": [phone["number"] for phone in org["phones"]],
+        })
+
+    return {
+        "buildings": _columns(list(buildings.values()), ("id", "address", "latitude", "longitude")),
+        "activities": _columns(list(activities.values()), ("id", "name", "parent_id")),
+        "organizations": _columns(organizations, ("id", "name", "building_id", "activity_ids", "phone_ids", "phones")),
+    }
+
+
+def encode_json(content: Any) -> bytes:
+    # так же, как starlette JSONResponse
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def encode_msgpack(content: Any) -> bytes:
+    return msgpack.packb(content, use_bin_type=True)
+
+
+ENCODERS: Dict[str, Callable[[Any], bytes]] = {
+    JSON: encode_json,
+    MSGPACK: encode_msgpack,
+    DICT_JSON: lambda content: encode_json(dictionary_encode(content)),
+    DICT_MSGPACK: lambda content: encode_msgpack(dictionary_encode(content)),
+}
+
+COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {
+    "zstd": _zstd.compress,
+    "gzip": lambda body: gzip.compress(body, compresslevel=6),
+}
+
+
+def _parse_header(value: str) -> List[Tuple[str, float]]:
+    # "a/b;q=0.5, c/d" -> [("a/b", 0.5), ("c/d", 1.0)]
+    items = []
+    for part in value.split(","):
+        token, *params = [p.strip() for p in part.split(";")]
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, val = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(val)
+                except ValueError:
+                    q = 0.0
+        items.append((token.lower(), q))
+    return items
+
+
+def _choose(header: str, supported: Tuple[str, ...], wildcards: Dict[str, str]) -> Optional[str]:
+    # при равном q выигрывает тот, кто раньше в supported
+    best, best_q = None, 0.0
+    for token, q in _parse_header(header):
+        candidate = token if token in supported else wildcards.get(token)
+        if candidate is None or q <= 0:
+            continue
+        if q > best_q or (q == best_q and supported.index(candidate) < supported.index(best)):
+            best, best_q = candidate, q
+    return best
+
+
+def choose_media_type(accept: str, dictionary: bool = False) -> str:
+    supported = tuple(ENCODERS) if dictionary else (JSON, MSGPACK)
+    chosen = _choose(accept, supported, {"*/*": JSON, "application/*": JSON})
+    return chosen or JSON
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    return _choose(accept_encoding, tuple(COMPRESSORS), {"*": "zstd"})
+
+
+class ContentResponse(Response):
+    # тело собирается в NegotiatedRoute, когда известен формат из Accept
+    media_type = JSON
+
+    def __init__(
+        self,
+        content: Any,
+        status_code: int = 200,
+        headers: Optional[Dict[str, str]] = None,
+        media_type: Optional[str] = None,
+        background: Optional[BackgroundTask] = None,
+    ):
+        self.content = content
+        super().__init__(None, status_code, headers, media_type, background)
+
+
+def render_negotiated(request: Request, response: ContentResponse, dictionary: bool = False) -> Response:
+    media_type = choose_media_type(request.headers.get("accept", ""), dictionary)
+    body = ENCODERS[media_type](response.content)
+    response.headers["content-type"] = media_type
+    response.headers["vary"] = "Accept, Accept-Encoding"
+
+    encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+    if encoding and len(body) >= settings.COMPRESSION_MIN_SIZE:
+        body = COMPRESSORS[encoding](body)
+        response.headers["content-encoding"] = encoding
+
+    response.body = body
+    response.headers["content-length"] = str(len(body))
+    return response
+
+
+class NegotiatedRoute(APIRoute):
+    # json / msgpack / словарный формат по Accept и сжатие по Accept-Encoding
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any):
+        if isinstance(kwargs.get("response_class"), DefaultPlaceholder):
+            kwargs["response_class"] = ContentResponse
+        super().__init__(path, endpoint, **kwargs)
+        # словарный формат есть только у списков организаций, на остальных роутах - обычный json
+        self.dictionary = get_origin(self.response_model) in (list, List) and get_args(self.response_model) == (OrganizationRead,)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def negotiated_handler(request: Request) -> Response:
+            response = await handler(request)
+            if isinstance(response, ContentResponse):
+                return render_negotiated(request, response, self.dictionary)
+            return response
+
+        return negotiated_handler
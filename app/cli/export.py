@@ -0,0 +1,30 @@
+import argparse
+import asyncio
+import sys
+
+from app.db.session import engine
+from app.services.export import ExportTable, stream_copy
+
+
+async def export(table: ExportTable, path: str) -> None:
+    output = sys.stdout.buffer if path == "-" else open(path, "wb")
+    try:
+        async with engine.connect() as connection:
+            async for chunk in stream_copy(connection, table):
+                output.write(chunk)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stream a CSV snapshot via COPY TO STDOUT")
+    parser.add_argument("table", choices=[table.value for table in ExportTable])
+    parser.add_argument("-o", "--output", default="-", help="file path, '-' for stdout")
+    args = parser.parse_args()
+    asyncio.run(export(ExportTable(args.table), args.output))
+
+
+if __name__ == "__main__":
+    main()
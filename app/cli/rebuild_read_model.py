@@ -0,0 +1,20 @@
+import asyncio
+
+from app.db.read_model import rebuild_read_model
+from app.db.session import engine, AsyncSessionLocal
+
+
+async def rebuild() -> None:
+    try:
+        async with AsyncSessionLocal() as session:
+            await rebuild_read_model(session)
+    finally:
+        await engine.dispose()
+
+
+def main() -> None:
+    asyncio.run(rebuild())
+
+
+if __name__ == "__main__":
+    main()
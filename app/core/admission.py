@@ -0,0 +1,158 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, Optional
+
+from app.core.config import settings
+
+
+class Overloaded(Exception):
+    # запрос не пустили: очередь полна или ждали слишком долго
+    def __init__(self, retry_after: float):
+        super().__init__("Server is overloaded")
+        self.retry_after = retry_after
+
+
+def retry_after_header(seconds: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> float:
+        # 0 - токен взят, иначе сколько секунд ждать следующего
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    # отдельное ведро на каждый ключ, старые ключи вытесняются (LRU), чтобы память не росла
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.limited_total = 0
+
+    def check(self, key: str) -> float:
+        # rate = 0 - лимит выключен
+        if self.rate <= 0:
+            return 0.0
+
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+
+        wait = bucket.try_acquire()
+        if wait:
+            self.limited_total += 1
+        return wait
+
+
+class ConcurrencyLimiter:
+    # глобальный лимит одновременных запросов в БД + ограниченная очередь ожидания
+    def __init__(self, limit: int, max_queue: int, queue_timeout: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted_total = 0
+        self.shed_total = 0
+
+    async def acquire(self) -> None:
+        if self.semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.shed_total += 1
+                raise Overloaded(self.queue_timeout)
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.shed_total += 1
+                raise Overloaded(self.queue_timeout)
+            finally:
+                self.waiting -= 1
+        else:
+            await self.semaphore.acquire()
+
+        self.in_flight += 1
+        self.admitted_total += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self.semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class DbLease:
+    # слот БД одного запроса: берется лениво, там, где реально идет работа с базой
+    # (ведущий single-flight), ждущие чужого результата слот не занимают
+    def __init__(self, limiter: ConcurrencyLimiter):
+        self.limiter = limiter
+        self.held = False
+
+    async def acquire(self) -> None:
+        if not self.held:
+            await self.limiter.acquire()
+            self.held = True
+
+    def release(self) -> None:
+        if self.held:
+            self.held = False
+            self.limiter.release()
+
+
+# слот текущего запроса, ставит admit_request
+current_lease: ContextVar[Optional[DbLease]] = ContextVar("db_lease", default=None)
+
+
+async def acquire_current_lease() -> None:
+    # вне запроса (тесты, cli) лимита нет
+    lease = current_lease.get()
+    if lease is not None:
+        await lease.acquire()
+
+
+rate_limiter = RateLimiter(settings.RATE_LIMIT_PER_SECOND, settings.RATE_LIMIT_BURST)
+db_limiter = ConcurrencyLimiter(
+    settings.DB_MAX_CONCURRENCY,
+    settings.DB_MAX_QUEUE,
+    settings.DB_QUEUE_TIMEOUT,
+)
+
+
+def admission_metrics() -> Dict[str, float]:
+    return {
+        "db_in_flight": db_limiter.in_flight,
+        "db_queue_depth": db_limiter.waiting,
+        "db_admitted_total": db_limiter.admitted_total,
+        "db_shed_total": db_limiter.shed_total,
+        "rate_limited_total": rate_limiter.limited_total,
+    }
@@ -1,3 +1,4 @@
+from typing import Dict, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
 
@@ -9,6 +10,52 @@ class Settings(BaseSettings):
     # дебаг режим
     DEBUG: bool = False
 
+    # single-flight: максимум одновременно "висящих" ключей, сверх лимита запросы идут мимо
+    SINGLE_FLIGHT_MAX_KEYS: int = 1024
+
+    # лимиты на API ключ (token bucket): запросов в секунду и размер всплеска, 0 - выключено
+    # ключ сейчас один (API_KEY) на всех клиентов, так что это общий лимит на весь сервис
+    RATE_LIMIT_PER_SECOND: float = 0.0
+    RATE_LIMIT_BURST: int = 40
+
+    # admission control: одновременные запросы в БД и очередь ожидания, сверх - 503
+    DB_MAX_CONCURRENCY: int = 10
+    DB_MAX_QUEUE: int = 100
+    DB_QUEUE_TIMEOUT: float = 2.0
+
+    # statement_timeout в мс: по умолчанию и для отдельных роутов (ключ - имя роута)
+    STATEMENT_TIMEOUT_MS: int = 5000
+    STATEMENT_TIMEOUTS: Dict[str, int] = {
+        "search_organizations_by_name": 2000,
+        "search_organizations_geo": 3000,
+        "search_buildings_geo": 3000,
+        "suggest_organizations_by_prefix": 500,
+    }
+
+    # ответы меньше этого размера (байт) не сжимаем
+    COMPRESSION_MIN_SIZE: int = 1024
+
+    # читать организации из денормализованной organization_read_model вместо join'ов
+    READ_MODEL_ENABLED: bool = False
+
+    # ключ для /admin и профилирования по заголовку X-Profile, без ключа все выключено
+    ADMIN_API_KEY: Optional[str] = None
+    # автоматический профиль медленных запросов: доля запросов под запись и порог в мс
+    PROFILE_SAMPLE_RATE: float = 0.0
+    PROFILE_SLOW_MS: float = 1000.0
+    PROFILE_INTERVAL_MS: float = 5.0
+    PROFILE_STORE_SIZE: int = 100
+    # общий для всех воркеров каталог с отчетами
+    PROFILE_STORE_DIR: str = "/dev/shm/org_directory_profiles"
+
+    # общий кэш воркеров в mmap файле: координаты зданий и дерево категорий
+    # данные отстают от базы не больше чем на SHARED_CACHE_REFRESH_SECONDS
+    SHARED_CACHE_ENABLED: bool = False
+    SHARED_CACHE_DIR: str = "/dev/shm/org_directory_cache"
+    SHARED_CACHE_REFRESH_SECONDS: float = 60.0
+    # сколько зданий в полосе широт максимум проверяем в питоне, больше - считаем в sql
+    SHARED_CACHE_MAX_SCAN: int = 2000
+
     model_config = SettingsConfigDict(
         case_sensitive=True,
         env_file=".env",
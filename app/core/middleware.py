@@ -0,0 +1,47 @@
+import asyncio
+
+
+class CancelOnDisconnectMiddleware:
+    # клиент ушел - отменяем обработчик запроса
+    # asyncpg на отмену ожидающего запроса сам шлет в postgres cancel request,
+    # так что брошенные запросы не жгут CPU базы и соединения пула
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        messages: asyncio.Queue = asyncio.Queue()
+        response_complete = False
+
+        async def tracking_send(message):
+            nonlocal response_complete
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+
+        handler = asyncio.ensure_future(self.app(scope, messages.get, tracking_send))
+
+        async def watch_disconnect():
+            # сами читаем receive и пересылаем сообщения обработчику через очередь
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    # после отправки ответа uvicorn тоже отдает http.disconnect - это не уход клиента,
+                    # а обработчик еще выполняет BackgroundTasks, их не трогаем
+                    if not response_complete:
+                        handler.cancel()
+                    return
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            # отменили нас снаружи (shutdown) - пробрасываем, отменили из-за клиента - отвечать некому
+            if asyncio.current_task().cancelling():
+                raise
+        finally:
+            watcher.cancel()
@@ -0,0 +1,228 @@
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.core.config import settings
+
+EXPLAIN = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) "
+
+
+class StackSampler:
+    # семплирующий профайлер: один поток на процесс раз в interval снимает стек потока event loop'а,
+    # пока есть хотя бы один профилируемый запрос, и раздает семпл всем подписчикам.
+    # на loop'е крутятся и чужие корутины, так что это профиль процесса на время запроса
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.thread_id: Optional[int] = None
+        self._subscribers: List[Counter] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self) -> Counter:
+        samples: Counter = Counter()
+        with self._lock:
+            self.thread_id = threading.get_ident()
+            self._subscribers.append(samples)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+        return samples
+
+    def unsubscribe(self, samples: Counter) -> None:
+        with self._lock:
+            self._subscribers.remove(samples)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._subscribers:
+                    # последний подписчик ушел - поток завершается, следующий subscribe запустит новый
+                    self._thread = None
+                    return
+                subscribers = list(self._subscribers)
+
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            collapsed = ";".join(reversed(stack))
+            for samples in subscribers:
+                samples[collapsed] += 1
+
+    @staticmethod
+    def report(samples: Counter, limit: int = 30) -> List[Dict[str, Any]]:
+        # collapsed stacks (как для flamegraph), самые частые сверху
+        return [{"stack": stack, "samples": count} for stack, count in samples.most_common(limit)]
+
+
+class StatementRecorder:
+    # пишет все SQL запросы сессии: слушаем after_begin сессии и вешаем события на ее соединения
+    def __init__(self, session: AsyncSession):
+        self.async_session = session
+        self.session = session.sync_session
+        self.statements: List[Dict[str, Any]] = []
+        self._connections = []
+
+    def _after_begin(self, _session, _transaction, connection) -> None:
+        if connection not in self._connections:
+            event.listen(connection, "before_cursor_execute", self._before_execute)
+            event.listen(connection, "after_cursor_execute", self._after_execute)
+            self._connections.append(connection)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        self.statements.append({
+            "statement": statement,
+            "parameters": parameters,
+            "started": time.perf_counter(),
+        })
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        record = self.statements[-1]
+        record["duration_ms"] = round((time.perf_counter() - record.pop("started")) * 1000, 3)
+
+    async def start(self) -> None:
+        event.listen(self.session, "after_begin", self._after_begin)
+        # сессия могла взять соединение еще до нас (например, SET LOCAL)
+        if self.async_session.in_transaction():
+            connection = await self.async_session.connection()
+            self._after_begin(self.session, None, connection.sync_connection)
+
+    def stop(self) -> None:
+        event.remove(self.session, "after_begin", self._after_begin)
+        for connection in self._connections:
+            event.remove(connection, "before_cursor_execute", self._before_execute)
+            event.remove(connection, "after_cursor_execute", self._after_execute)
+        self._connections.clear()
+
+
+class RequestProfile:
+    def __init__(self, session: AsyncSession, trigger: str):
+        self.id = uuid.uuid4().hex
+        self.trigger = trigger
+        self.recorder = StatementRecorder(session)
+        self.samples: Counter = Counter()
+        self.started = 0.0
+        self.duration_ms = 0.0
+
+    async def start(self) -> None:
+        await self.recorder.start()
+        self.started = time.perf_counter()
+        self.samples = sampler.subscribe()
+
+    def stop(self) -> None:
+        self.duration_ms = round((time.perf_counter() - self.started) * 1000, 3)
+        sampler.unsubscribe(self.samples)
+        self.recorder.stop()
+
+    async def explain(self, connection: AsyncConnection) -> None:
+        # уже после ответа, на отдельном соединении: EXPLAIN ANALYZE повторно выполняет запрос,
+        # поэтому только для чтений и под обычным statement_timeout
+        await connection.execute(text(f"SET LOCAL statement_timeout = {int(settings.STATEMENT_TIMEOUT_MS)}"))
+        for record in self.recorder.statements:
+            if not record["statement"].lstrip().upper().startswith(("SELECT", "WITH")):
+                continue
+            try:
+                result = await connection.exec_driver_sql(EXPLAIN + record["statement"], record["parameters"])
+                plan = result.scalar()
+                record["plan"] = json.loads(plan) if isinstance(plan, str) else plan
+            except Exception as exc:
+                record["plan_error"] = str(exc)
+                break
+
+    def report(self, request_info: Dict[str, Any], explain: str) -> Dict[str, Any]:
+        # explain: pending - планы еще снимаются в фоне, done - готовы, skipped - запрос упал
+        return {
+            "id": self.id,
+            "trigger": self.trigger,
+            "explain": explain,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": self.duration_ms,
+            **request_info,
+            # стеки всего процесса за время запроса, не только этого обработчика
+            "python_scope": "process",
+            "python": StackSampler.report(self.samples),
+            "sql": [
+                {
+                    **{key: value for key, value in record.items() if key != "started"},
+                    "parameters": repr(record["parameters"]),
+                }
+                for record in self.recorder.statements
+            ],
+        }
+
+
+class ProfileStore:
+    # отчеты json файлами в общем каталоге (по умолчанию /dev/shm): воркеров uvicorn несколько,
+    # а GET /admin/profiles/{id} попадает в случайный - читать должен любой. Старые вытесняются
+    def __init__(self, directory: str, size: int):
+        self.directory = directory
+        self.size = size
+
+    def _path(self, profile_id: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    def _files(self) -> List[str]:
+        # новые первыми
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith(".json")]
+        except FileNotFoundError:
+            return []
+        paths = [os.path.join(self.directory, name) for name in names]
+        return sorted(paths, key=_mtime, reverse=True)
+
+    def add(self, report: Dict[str, Any]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(report["id"])
+        # атомарно: читатель в другом воркере не увидит половину файла
+        with open(f"{path}.{os.getpid()}.tmp", "w") as f:
+            json.dump(report, f, default=str)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+        for old in self._files()[self.size:]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(old)
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        # id приходит из url - только hex от uuid4, никаких путей
+        if not profile_id.isalnum():
+            return None
+        try:
+            with open(self._path(profile_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def summaries(self) -> List[Dict[str, Any]]:
+        keys = ("id", "trigger", "created_at", "duration_ms", "method", "path", "explain")
+        summaries = []
+        for path in self._files():
+            try:
+                with open(path) as f:
+                    report = json.load(f)
+            except FileNotFoundError:
+                continue
+            summaries.append({key: report.get(key) for key in keys})
+        return summaries
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+sampler = StackSampler(settings.PROFILE_INTERVAL_MS / 1000)
+profile_store = ProfileStore(settings.PROFILE_STORE_DIR, settings.PROFILE_STORE_SIZE)
@@ -0,0 +1,22 @@
+import re
+
+# диакритика, которую снимаем с имен (ё -> е, й -> и, é -> e, ...); символы в двух строках идут парами
+NAME_FOLD_FROM = "ёйàáâãäåāçćčèéêëēěìíîïīłñńňòóôõöøōřśšùúûüūůýÿźżž"
+NAME_FOLD_TO = "еиaaaaaaaccceeeeeeiiiiilnnnooooooorssuuuuuuyyzzz"
+_NAME_FOLD = str.maketrans(NAME_FOLD_FROM, NAME_FOLD_TO)
+
+# то же в sql: generated column organizations.name_normalized. Только immutable-функции
+# (lower/translate/regexp_replace), поэтому без unaccent
+NAME_NORMALIZED_SQL = (
+    f"btrim(regexp_replace(translate(lower(name), '{NAME_FOLD_FROM}', '{NAME_FOLD_TO}'), '\\s+', ' ', 'g'))"
+)
+
+def normalize_name(value: str) -> str:
+    # регистр и диакритика не важны: "Ёлка" -> "елка", "Йогурт" -> "иогурт", "Café" -> "cafe"
+    # повторяет NAME_NORMALIZED_SQL, чтобы префикс запроса совпадал с тем, что посчитала база
+    return " ".join(value.lower().translate(_NAME_FOLD).split())
+
+def normalize_phone(value: str) -> str:
+    # только цифры: "8-800-555-35-35" -> "88005553535", "+7 (800) 555" -> "7800555"
+    # то же выражение считает generated column organization_phones.number_digits
+    return re.sub(r"[^0-9]", "", value)
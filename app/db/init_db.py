@@ -1,16 +1,27 @@
-from sqlalchemy import select
-from app.models.orm import Activity, Building, Organization, OrganizationPhone
+from sqlalchemy import select, text
+from app.models.orm import Activity, Building, Organization, OrganizationPhone, OrganizationReadModel
 from sqlalchemy.orm import selectinload
+from app.db.read_model import REBUILD_LOCK_KEY, rebuild_read_model
 from app.db.session import engine, Base, AsyncSessionLocal
 
 async def init_db():
     # в проде конечно лучше alembic, но для теста сойдет и create_all
+    # воркеры стартуют одновременно: create_all (и DDL модели чтения) выполняет по очереди,
+    # параллельный CREATE OR REPLACE FUNCTION падает с "tuple concurrently updated"
     async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": REBUILD_LOCK_KEY})
         await conn.run_sync(Base.metadata.create_all)
 
     async with AsyncSessionLocal() as session:
         result = await session.execute(select(Activity))
         if result.first():
+            # таблицу модели чтения только что создали на живых данных - заполняем
+            # воркеры uvicorn стартуют одновременно: под advisory lock пересчитывает только первый,
+            # остальные дождутся его commit и увидят заполненную таблицу
+            await session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": REBUILD_LOCK_KEY})
+            has_read_model = await session.execute(select(OrganizationReadModel.organization_id).limit(1))
+            if not has_read_model.first():
+                await rebuild_read_model(session)
             return
 
         # наливаем тестовые данные
@@ -0,0 +1,118 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# денормализованная модель чтения organization_read_model поддерживается триггерами в самой базе:
+# любая запись в organizations / buildings / organization_activity / organization_phones / activities
+# пересчитывает строки затронутых организаций. Все выражения идемпотентны (create_all и миграция).
+
+REFRESH_FUNCTION = """
+CREATE OR REPLACE FUNCTION refresh_organization_read_model(org_ids integer[]) RETURNS void AS $$
+BEGIN
+    -- org_ids = NULL - пересчитать все организации
+    INSERT INTO organization_read_model (
+        organization_id, name, building_id, address, latitude, longitude, document, activity_ancestor_ids
+    )
+    SELECT
+        o.id, o.name, b.id, b.address, b.latitude, b.longitude,
+        jsonb_build_object(
+            'activities', COALESCE((
+                SELECT jsonb_agg(jsonb_build_object('id', a.id, 'name', a.name, 'parent_id', a.parent_id) ORDER BY a.id)
+                FROM organization_activity oa JOIN activities a ON a.id = oa.activity_id
+                WHERE oa.organization_id = o.id
+            ), CAST('[]' AS jsonb)),
+            'phones', COALESCE((
+                SELECT jsonb_agg(jsonb_build_object('id', p.id, 'number', p.number) ORDER BY p.id)
+                FROM organization_phones p
+                WHERE p.organization_id = o.id
+            ), CAST('[]' AS jsonb))
+        ),
+        -- категории организации вместе со всеми предками: фильтр по категории = одно @> по GIN
+        COALESCE((
+            WITH RECURSIVE up(id, parent_id) AS (
+                SELECT a.id, a.parent_id
+                FROM organization_activity oa JOIN activities a ON a.id = oa.activity_id
+                WHERE oa.organization_id = o.id
+                UNION
+                SELECT p.id, p.parent_id FROM activities p JOIN up ON p.id = up.parent_id
+            )
+            SELECT array_agg(id ORDER BY id) FROM up
+        ), CAST('{}' AS integer[]))
+    FROM organizations o JOIN buildings b ON b.id = o.building_id
+    WHERE org_ids IS NULL OR o.id = ANY(org_ids)
+    ON CONFLICT (organization_id) DO UPDATE SET
+        name = EXCLUDED.name,
+        building_id = EXCLUDED.building_id,
+        address = EXCLUDED.address,
+        latitude = EXCLUDED.latitude,
+        longitude = EXCLUDED.longitude,
+        document = EXCLUDED.document,
+        activity_ancestor_ids = EXCLUDED.activity_ancestor_ids;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+SYNC_FUNCTION = """
+CREATE OR REPLACE FUNCTION sync_organization_read_model() RETURNS trigger AS $$
+BEGIN
+    -- удаление организации чистит модель через ON DELETE CASCADE
+    IF TG_TABLE_NAME = 'organizations' THEN
+        PERFORM refresh_organization_read_model(ARRAY[NEW.id]);
+    ELSIF TG_TABLE_NAME = 'buildings' THEN
+        PERFORM refresh_organization_read_model(ARRAY(SELECT id FROM organizations WHERE building_id = NEW.id));
+    ELSIF TG_TABLE_NAME = 'activities' THEN
+        -- переименование или перенос категории меняет документ и предков у всего поддерева
+        PERFORM refresh_organization_read_model(ARRAY(
+            WITH RECURSIVE down(id) AS (
+                SELECT NEW.id
+                UNION
+                SELECT a.id FROM activities a JOIN down ON a.parent_id = down.id
+            )
+            SELECT DISTINCT oa.organization_id FROM organization_activity oa JOIN down ON oa.activity_id = down.id
+        ));
+    ELSE
+        -- organization_activity, organization_phones
+        IF TG_OP <> 'INSERT' THEN
+            PERFORM refresh_organization_read_model(ARRAY[OLD.organization_id]);
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            PERFORM refresh_organization_read_model(ARRAY[NEW.organization_id]);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+# таблица -> события, на которые вешаем триггер
+TRIGGERS = {
+    "organizations": "INSERT OR UPDATE",
+    "buildings": "UPDATE",
+    "activities": "UPDATE",
+    "organization_activity": "INSERT OR UPDATE OR DELETE",
+    "organization_phones": "INSERT OR UPDATE OR DELETE",
+}
+
+TRIGGER_NAME = "trg_sync_organization_read_model"
+
+# ключ pg_advisory_xact_lock: create_all и заполнение на старте делает один воркер, остальные ждут
+REBUILD_LOCK_KEY = 7310031
+
+READ_MODEL_DDL = [REFRESH_FUNCTION, SYNC_FUNCTION]
+for _table, _events in TRIGGERS.items():
+    READ_MODEL_DDL.append(f"DROP TRIGGER IF EXISTS {TRIGGER_NAME} ON {_table}")
+    READ_MODEL_DDL.append(
+        f"CREATE TRIGGER {TRIGGER_NAME} AFTER {_events} ON {_table} "
+        f"FOR EACH ROW EXECUTE FUNCTION sync_organization_read_model()"
+    )
+
+DROP_READ_MODEL_DDL = [f"DROP TRIGGER IF EXISTS {TRIGGER_NAME} ON {table}" for table in TRIGGERS] + [
+    "DROP FUNCTION IF EXISTS sync_organization_read_model()",
+    "DROP FUNCTION IF EXISTS refresh_organization_read_model(integer[])",
+]
+
+
+async def rebuild_read_model(session: AsyncSession) -> None:
+    # полный пересчет: после массовой заливки или если модель разъехалась с данными
+    await session.execute(text("TRUNCATE organization_read_model"))
+    await session.execute(text("SELECT refresh_organization_read_model(NULL)"))
+    await session.commit()
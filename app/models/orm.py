@@ -1,7 +1,10 @@
-from typing import List, Optional
-from sqlalchemy import String, Integer, Float, ForeignKey, Table, Column
+from typing import Any, Dict, List, Optional
+from sqlalchemy import DDL, Computed, String, Integer, Float, ForeignKey, Index, Table, Column, event, func
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from app.db.session import Base
+from app.db.read_model import READ_MODEL_DDL
+from app.core.text import NAME_NORMALIZED_SQL
 
 # таблица связей м2м
 organization_activity = Table(
@@ -38,6 +41,11 @@ class Organization(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     name: Mapped[str] = mapped_column(String, index=True)
+    # имя для автодополнения (как normalize_name), collation "C" - индекс годится и для LIKE 'префикс%', и для ORDER BY
+    # generated column, как number_digits: верно и для сырого SQL, COPY и bulk update()
+    name_normalized: Mapped[str] = mapped_column(
+        String(collation="C"), Computed(NAME_NORMALIZED_SQL, persisted=True), index=True
+    )
     building_id: Mapped[int] = mapped_column(ForeignKey("buildings.id"))
 
     building: Mapped["Building"] = relationship(back_populates="organizations")
@@ -49,6 +57,44 @@ class OrganizationPhone(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     number: Mapped[str] = mapped_column(String)
+    # только цифры номера (как normalize_phone) для обратного поиска "чей это номер"
+    # generated column: считает сама база, так что верно и для сырого SQL, COPY и bulk update()
+    number_digits: Mapped[str] = mapped_column(
+        String(collation="C"), Computed("regexp_replace(number, '[^0-9]', '', 'g')", persisted=True), index=True
+    )
     organization_id: Mapped[int] = mapped_column(ForeignKey("organizations.id", ondelete="CASCADE"))
 
     organization: Mapped["Organization"] = relationship(back_populates="phones")
+
+# поиск по окончанию номера - префикс по перевернутой строке, тот же range scan
+Index("ix_organization_phones_number_digits_reversed", func.reverse(OrganizationPhone.number_digits))
+
+
+class OrganizationReadModel(Base):
+    # модель чтения: организация + здание + категории + телефоны одной строкой, без join'ов
+    # поддерживается триггерами (app/db/read_model.py)
+    __tablename__ = "organization_read_model"
+
+    organization_id: Mapped[int] = mapped_column(ForeignKey("organizations.id", ondelete="CASCADE"), primary_key=True)
+    name: Mapped[str] = mapped_column(String, index=True)
+    building_id: Mapped[int] = mapped_column(Integer, index=True)
+    address: Mapped[str] = mapped_column(String)
+    latitude: Mapped[float] = mapped_column(Float)
+    longitude: Mapped[float] = mapped_column(Float)
+    # {"activities": [...], "phones": [...]}
+    document: Mapped[Dict[str, Any]] = mapped_column(JSONB)
+    # id категорий организации и всех их предков
+    activity_ancestor_ids: Mapped[List[int]] = mapped_column(ARRAY(Integer))
+
+    __table_args__ = (
+        Index("ix_organization_read_model_coords", "latitude", "longitude"),
+        Index("ix_organization_read_model_activity_ancestor_ids", "activity_ancestor_ids", postgresql_using="gin"),
+    )
+
+# функции и триггеры ставим после create_all (init_db, тесты), но только когда таблица модели
+# создается впервые: на каждом старте воркера не перезаписываем то, что поставила миграция
+@event.listens_for(Base.metadata, "after_create")
+def _install_read_model(target, connection, tables=(), **kw) -> None:
+    if OrganizationReadModel.__table__ in tables:
+        for statement in READ_MODEL_DDL:
+            connection.execute(DDL(statement))
@@ -65,3 +65,8 @@ class OrganizationRead(OrganizationBase):
     activities: List[ActivityRead]
     phones: List[PhoneRead]
     model_config = ConfigDict(from_attributes=True)
+
+class OrganizationSuggestion(BaseModel):
+    id: int
+    name: str
+    model_config = ConfigDict(from_attributes=True)
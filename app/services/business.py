@@ -1,11 +1,101 @@
+import asyncio
+import functools
+import sys
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_
-from sqlalchemy.orm import selectinload
-from typing import List, Optional
-from app.models.orm import Activity, Organization, Building
+from sqlalchemy import Integer, select, func, and_, any_, bindparam, inspect
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import InstanceState, selectinload
+from typing import Any, Dict, Hashable, List, Optional
+from app.core.admission import acquire_current_lease
+from app.core.config import settings
+from app.core.text import normalize_name
+from app.models.orm import Activity, Organization, OrganizationPhone, Building
+from app.services.shared_cache import get_snapshot
+
+# запросы, которые сейчас считаются в базе: ключ -> future с результатом
+_in_flight: Dict[Hashable, asyncio.Future] = {}
+
+def _detach(session: AsyncSession, value: Any) -> None:
+    # результат ведущего уходит в чужие запросы: отвязываем объекты от его сессии вместе
+    # с загруженными связями, чтобы rollback/close этой сессии не трогал их у ждущих
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            _detach(session, item)
+        return
+
+    state = inspect(value, raiseerr=False)
+    if not isinstance(state, InstanceState) or value not in session:
+        return
+    session.expunge(value)
+    for relationship in state.mapper.relationships:
+        if relationship.key not in state.unloaded:
+            _detach(session, getattr(value, relationship.key))
+
+def single_flight(func):
+    # одинаковые параллельные вызовы ждут один запрос в базу вместо своего
+    # ключ - функция + аргументы без сессии (у каждого запроса она своя)
+    # запрос идет в сессии ведущего и под его statement_timeout - он действует на всех ждущих
+    @functools.wraps(func)
+    async def wrapper(session: AsyncSession, *args: Any, **kwargs: Any):
+        key = (func, args, tuple(sorted(kwargs.items())))
+
+        while True:
+            future = _in_flight.get(key)
+            if future is None:
+                break
+            try:
+                # shield: отмена ждущего не должна отменять общий запрос
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # отменили ведущего (клиент ушел) - пробуем сами стать ведущим
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+
+        # в базу идет только ведущий - он и занимает слот DB_MAX_CONCURRENCY
+        await acquire_current_lease()
+
+        # память ограничена: при переполнении просто идем в базу без склейки
+        if len(_in_flight) >= settings.SINGLE_FLIGHT_MAX_KEYS:
+            return await func(session, *args, **kwargs)
+
+        future = asyncio.get_running_loop().create_future()
+        _in_flight[key] = future
+        try:
+            result = await func(session, *args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            # помечаем исключение прочитанным, иначе asyncio ругается в лог без ждущих
+            future.exception()
+            raise
+        else:
+            if session is not None:
+                _detach(session, result)
+            future.set_result(result)
+            return result
+        finally:
+            if _in_flight.get(key) is future:
+                del _in_flight[key]
+
+    return wrapper
+
+def _int_array(ids: List[int]):
+    # один параметр-массив вместо IN (...) на тысячи параметров
+    return bindparam("ids", ids, type_=ARRAY(Integer))
 
 async def get_activity_subtree_ids(session: AsyncSession, root_id: int) -> List[int]:
     # рекурсивно забираем все id вложенных категорий
+    # с общим кэшем воркеров дерево обходим в памяти без запроса в базу
+    # промах (категорию создали после последнего поколения) - не "нет категории", а повод спросить базу
+    snapshot = get_snapshot()
+    if snapshot:
+        activity_ids = snapshot.activity_subtree_ids(root_id)
+        if activity_ids:
+            return activity_ids
+
     # используем CTE, чтобы не грузить питон лишними запросами
     base_query = select(Activity.id).where(Activity.id == root_id).cte("activity_cte", recursive=True)
     
@@ -35,11 +125,42 @@ async def check_activity_depth(session: AsyncSession, parent_id: Optional[int])
     
     return count < 3
 
+@single_flight
+async def get_organizations_by_activity(session: AsyncSession, activity_id: int) -> Optional[List[Organization]]:
+    # None - если такой категории нет
+    activity_ids = await get_activity_subtree_ids(session, activity_id)
+    if not activity_ids:
+        return None
+
+    stmt = select(Organization).join(Organization.activities).options(
+        selectinload(Organization.building),
+        selectinload(Organization.activities),
+        selectinload(Organization.phones)
+    ).where(Activity.id.in_(activity_ids)).distinct()
+
+    result = await session.execute(stmt)
+    return result.scalars().all()
+
+@single_flight
 async def get_organizations_in_radius(session: AsyncSession, lat: float, lon: float, radius_km: float) -> List[Organization]:
     # ищем соседей через haversine
     # формула гаверсинуса в sql, потому что postgis тянуть ради этого оверкилл
     earth_radius = 6371
     
+    snapshot = get_snapshot()
+    building_ids = snapshot.building_ids_in_radius(lat, lon, radius_km, settings.SHARED_CACHE_MAX_SCAN) if snapshot else None
+    if building_ids is not None:
+        # здания в радиусе посчитаны по общему кэшу, в базу идем только за организациями
+        if not building_ids:
+            return []
+        stmt = select(Organization).options(
+            selectinload(Organization.building),
+            selectinload(Organization.activities),
+            selectinload(Organization.phones)
+        ).where(Organization.building_id == any_(_int_array(building_ids)))
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
     # хардкорная математика
     # d = 2 * R * asin... но через acos обычно стабильнее в базы ложится
     stmt = select(Organization).join(Building).options(
@@ -61,6 +182,7 @@ async def get_organizations_in_radius(session: AsyncSession, lat: float, lon: fl
     result = await session.execute(stmt)
     return result.scalars().all()
 
+@single_flight
 async def get_organizations_in_bbox(session: AsyncSession, min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> List[Organization]:
     # поиск квадратом (bbox)
     stmt = select(Organization).join(Building).options(
@@ -79,7 +201,16 @@ async def get_organizations_in_bbox(session: AsyncSession, min_lat: float, max_l
     return result.scalars().all()
 
 
+@single_flight
 async def get_buildings_in_radius(session: AsyncSession, lat: float, lon: float, radius_km: float) -> List[Building]:
+    snapshot = get_snapshot()
+    building_ids = snapshot.building_ids_in_radius(lat, lon, radius_km, settings.SHARED_CACHE_MAX_SCAN) if snapshot else None
+    if building_ids is not None:
+        if not building_ids:
+            return []
+        result = await session.execute(select(Building).where(Building.id == any_(_int_array(building_ids))))
+        return result.scalars().all()
+
     earth_radius = 6371
     stmt = select(Building).where(
         (
@@ -95,6 +226,7 @@ async def get_buildings_in_radius(session: AsyncSession, lat: float, lon: float,
     result = await session.execute(stmt)
     return result.scalars().all()
 
+@single_flight
 async def get_buildings_in_bbox(session: AsyncSession, min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> List[Building]:
     stmt = select(Building).where(
         and_(
@@ -106,3 +238,44 @@ async def get_buildings_in_bbox(session: AsyncSession, min_lat: float, max_lat:
     )
     result = await session.execute(stmt)
     return result.scalars().all()
+
+def _prefix_range(column, prefix: str):
+    # [prefix, prefix с последним символом +1) - в collation "C" это порядок code point'ов
+    conditions = [column >= prefix]
+    if ord(prefix[-1]) < sys.maxunicode:
+        conditions.append(column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+    return and_(*conditions)
+
+async def suggest_organizations(session: AsyncSession, prefix: str, limit: int) -> List[Any]:
+    # автодополнение: только id и name по префиксу нормализованного имени
+    normalized = normalize_name(prefix)
+    if not normalized:
+        return []
+
+    # префикс как диапазон по индексу: в отличие от LIKE $1 индекс используется
+    # и в generic плане prepared statement'а asyncpg
+    stmt = select(Organization.id, Organization.name).where(
+        _prefix_range(Organization.name_normalized, normalized)
+    ).order_by(Organization.name_normalized).limit(limit)
+
+    result = await session.execute(stmt)
+    return result.all()
+
+async def get_organizations_by_phone(session: AsyncSession, digits: str, suffix: bool = False) -> List[Organization]:
+    # обратный поиск по номеру: точное совпадение цифр или совпадение окончания
+    # ("555-35-35" найдет и "8-800-555-35-35", и "+7 800 555 35 35")
+    if suffix:
+        condition = _prefix_range(func.reverse(OrganizationPhone.number_digits), digits[::-1])
+    else:
+        condition = OrganizationPhone.number_digits == digits
+
+    stmt = select(Organization).options(
+        selectinload(Organization.building),
+        selectinload(Organization.activities),
+        selectinload(Organization.phones)
+    ).where(
+        Organization.id.in_(select(OrganizationPhone.organization_id).where(condition))
+    )
+
+    result = await session.execute(stmt)
+    return result.scalars().all()
@@ -0,0 +1,82 @@
+import asyncio
+from enum import Enum
+from typing import AsyncIterator
+
+import anyio
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# сколько чанков COPY держим в памяти; дальше asyncpg перестает читать сокет и база ждет клиента
+EXPORT_BUFFER_CHUNKS = 16
+
+
+class ExportTable(str, Enum):
+    buildings = "buildings"
+    organizations = "organizations"
+    organization_phones = "organization_phones"
+    organization_activity = "organization_activity"
+    activities = "activities"
+    # одна строка на организацию: здание, категории и телефоны через "|"
+    organizations_flat = "organizations_flat"
+
+
+EXPORT_QUERIES = {
+    ExportTable.buildings: "SELECT id, address, latitude, longitude FROM buildings ORDER BY id",
+    ExportTable.organizations: "SELECT id, name, building_id FROM organizations ORDER BY id",
+    ExportTable.organization_phones: "SELECT id, organization_id, number FROM organization_phones ORDER BY id",
+    ExportTable.organization_activity: (
+        "SELECT organization_id, activity_id FROM organization_activity ORDER BY organization_id, activity_id"
+    ),
+    ExportTable.activities: "SELECT id, name, parent_id FROM activities ORDER BY id",
+    ExportTable.organizations_flat: """
+        SELECT
+            o.id, o.name, b.id AS building_id, b.address, b.latitude, b.longitude,
+            (
+                SELECT string_agg(a.name, '|' ORDER BY a.name)
+                FROM organization_activity oa JOIN activities a ON a.id = oa.activity_id
+                WHERE oa.organization_id = o.id
+            ) AS activities,
+            (
+                SELECT string_agg(p.number, '|' ORDER BY p.id)
+                FROM organization_phones p
+                WHERE p.organization_id = o.id
+            ) AS phones
+        FROM organizations o JOIN buildings b ON b.id = o.building_id
+        ORDER BY o.id
+    """,
+}
+
+
+async def stream_copy(connection: AsyncConnection, table: ExportTable) -> AsyncIterator[bytes]:
+    # COPY ... TO STDOUT напрямую через asyncpg: без ORM и pydantic, память постоянная
+    raw = await connection.get_raw_connection()
+    driver = raw.driver_connection
+    query = EXPORT_QUERIES[table]
+
+    chunks: asyncio.Queue = asyncio.Queue(maxsize=EXPORT_BUFFER_CHUNKS)
+    done = object()
+
+    async def produce():
+        try:
+            await driver.copy_from_query(query, output=chunks.put, format="csv", header=True)
+        except Exception as exc:
+            await chunks.put(exc)
+            return
+        await chunks.put(done)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            chunk = await chunks.get()
+            if chunk is done:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        # клиент ушел посреди выгрузки - отменяем COPY и ждем, пока asyncpg его действительно остановит:
+        # иначе соединение вернется в пул, пока на нем еще идет запрос.
+        # shield - отмена от starlette (anyio) повторяется на каждом await и сорвала бы ожидание
+        if not producer.done():
+            producer.cancel()
+        with anyio.CancelScope(shield=True):
+            await asyncio.wait({producer})
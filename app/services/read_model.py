@@ -0,0 +1,76 @@
+from typing import Any, Dict, List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, and_
+from app.models.orm import Activity, OrganizationReadModel
+from app.services.business import single_flight
+
+# чтение организаций из organization_read_model: одна таблица, без join'ов и selectinload
+# отдаем словари в форме OrganizationRead
+
+def _to_dto(row: OrganizationReadModel) -> Dict[str, Any]:
+    return {
+        "id": row.organization_id,
+        "name": row.name,
+        "building_id": row.building_id,
+        "building": {
+            "id": row.building_id,
+            "address": row.address,
+            "latitude": row.latitude,
+            "longitude": row.longitude,
+        },
+        "activities": row.document["activities"],
+        "phones": row.document["phones"],
+    }
+
+async def _fetch(session: AsyncSession, *criteria) -> List[Dict[str, Any]]:
+    result = await session.execute(select(OrganizationReadModel).where(*criteria))
+    return [_to_dto(row) for row in result.scalars().all()]
+
+async def get_organization(session: AsyncSession, organization_id: int) -> Optional[Dict[str, Any]]:
+    rows = await _fetch(session, OrganizationReadModel.organization_id == organization_id)
+    return rows[0] if rows else None
+
+async def get_organizations_by_building(session: AsyncSession, building_id: int) -> List[Dict[str, Any]]:
+    return await _fetch(session, OrganizationReadModel.building_id == building_id)
+
+async def search_organizations_by_name(session: AsyncSession, q: str) -> List[Dict[str, Any]]:
+    return await _fetch(session, OrganizationReadModel.name.ilike(f"%{q}%"))
+
+@single_flight
+async def get_organizations_by_activity(session: AsyncSession, activity_id: int) -> Optional[List[Dict[str, Any]]]:
+    # предки уже лежат в activity_ancestor_ids, так что CTE не нужен - один @> по GIN индексу
+    rows = await _fetch(session, OrganizationReadModel.activity_ancestor_ids.contains([activity_id]))
+    if rows:
+        return rows
+
+    # пусто - отличаем "нет организаций" от "нет категории"
+    exists = await session.execute(select(Activity.id).where(Activity.id == activity_id))
+    return [] if exists.first() else None
+
+@single_flight
+async def get_organizations_in_radius(session: AsyncSession, lat: float, lon: float, radius_km: float) -> List[Dict[str, Any]]:
+    earth_radius = 6371
+    return await _fetch(
+        session,
+        (
+            earth_radius * func.acos(
+                func.cos(func.radians(lat)) *
+                func.cos(func.radians(OrganizationReadModel.latitude)) *
+                func.cos(func.radians(OrganizationReadModel.longitude) - func.radians(lon)) +
+                func.sin(func.radians(lat)) *
+                func.sin(func.radians(OrganizationReadModel.latitude))
+            )
+        ) <= radius_km
+    )
+
+@single_flight
+async def get_organizations_in_bbox(session: AsyncSession, min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> List[Dict[str, Any]]:
+    return await _fetch(
+        session,
+        and_(
+            OrganizationReadModel.latitude >= min_lat,
+            OrganizationReadModel.latitude <= max_lat,
+            OrganizationReadModel.longitude >= min_lon,
+            OrganizationReadModel.longitude <= max_lon
+        )
+    )
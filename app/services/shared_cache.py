@@ -0,0 +1,211 @@
+import asyncio
+import fcntl
+import glob
+import logging
+import math
+import mmap
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import List, Optional
+
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.orm import Activity, Building
+
+logger = logging.getLogger(__name__)
+
+# общий для всех воркеров uvicorn кэш в memory-mapped файле (по умолчанию в /dev/shm):
+# лидер (кто взял flock) строит новое поколение и атомарно переключает симлинк current,
+# остальные мапят файл read-only - страницы одни на всех, память не растет с числом воркеров.
+#
+# формат: заголовок, затем массивы по 8 байт на элемент
+#   latitudes  float64[n]  (здания отсортированы по широте - полоса ищется бисекцией)
+#   longitudes float64[n]
+#   building_ids int64[n]
+#   activity_ids int64[m]  (по возрастанию id)
+#   parent_ids   int64[m]  (-1 - корень)
+
+MAGIC = b"ORGCACHE"
+HEADER = struct.Struct("<8sQQQ")  # magic, generation, n_buildings, n_activities
+CURRENT = "current"
+LOCK = "leader.lock"
+NO_PARENT = -1
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+class CacheSnapshot:
+    # одно поколение кэша, только чтение
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, self.generation, n, m = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a cache file")
+
+        offset = HEADER.size
+
+        def take(fmt: str, count: int) -> memoryview:
+            nonlocal offset
+            data = view[offset:offset + 8 * count].cast(fmt)
+            offset += 8 * count
+            return data
+
+        self.latitudes = take("d", n)
+        self.longitudes = take("d", n)
+        self.building_ids = take("q", n)
+        self.activity_ids = take("q", m)
+        self.parent_ids = take("q", m)
+
+    def building_ids_in_radius(self, lat: float, lon: float, radius_km: float, max_scan: int) -> Optional[List[int]]:
+        # расстояние по дуге не меньше разницы широт, поэтому полоса по широте ничего не теряет
+        delta = radius_km / KM_PER_DEGREE
+        lo = bisect_left(self.latitudes, lat - delta)
+        hi = bisect_right(self.latitudes, lat + delta)
+        # цикл на питоне идет прямо в event loop'е: широкую полосу (большой радиус) отдаем базе
+        if hi - lo > max_scan:
+            return None
+
+        # та же формула, что и в sql (business.get_organizations_in_radius)
+        lat_rad, lon_rad = math.radians(lat), math.radians(lon)
+        sin_lat, cos_lat = math.sin(lat_rad), math.cos(lat_rad)
+        result = []
+        for i in range(lo, hi):
+            b_lat = math.radians(self.latitudes[i])
+            cos_angle = cos_lat * math.cos(b_lat) * math.cos(math.radians(self.longitudes[i]) - lon_rad) + sin_lat * math.sin(b_lat)
+            if EARTH_RADIUS_KM * math.acos(min(1.0, max(-1.0, cos_angle))) <= radius_km:
+                result.append(self.building_ids[i])
+        return result
+
+    def activity_subtree_ids(self, root_id: int) -> List[int]:
+        # как CTE в get_activity_subtree_ids: сам узел и все потомки, пусто - если узла нет
+        i = bisect_left(self.activity_ids, root_id)
+        if i == len(self.activity_ids) or self.activity_ids[i] != root_id:
+            return []
+
+        result = [root_id]
+        frontier = {root_id}
+        while frontier:
+            # дерево неглубокое (3 уровня), проход по массиву на уровень дешевле индекса в каждом воркере
+            frontier = {self.activity_ids[j] for j, parent in enumerate(self.parent_ids) if parent in frontier}
+            result.extend(frontier)
+        return result
+
+
+def write_generation(directory: str, generation: int, buildings: List[tuple], activities: List[tuple]) -> str:
+    buildings = sorted(buildings, key=lambda b: b[1])
+    activities = sorted(activities)
+
+    name = f"cache-{generation}.bin"
+    path = os.path.join(directory, name)
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, generation, len(buildings), len(activities)))
+        f.write(array("d", [b[1] for b in buildings]).tobytes())
+        f.write(array("d", [b[2] for b in buildings]).tobytes())
+        f.write(array("q", [b[0] for b in buildings]).tobytes())
+        f.write(array("q", [a[0] for a in activities]).tobytes())
+        f.write(array("q", [NO_PARENT if a[1] is None else a[1] for a in activities]).tobytes())
+    os.replace(path + ".tmp", path)
+
+    # атомарная смена поколения: новый симлинк поверх current
+    link = os.path.join(directory, f"{CURRENT}.{os.getpid()}")
+    os.symlink(name, link)
+    os.replace(link, os.path.join(directory, CURRENT))
+
+    # старые поколения удаляем, текущее и предыдущее оставляем; уже замапленные файлы живут до munmap
+    for old in glob.glob(os.path.join(directory, "cache-*.bin")):
+        old_generation = int(os.path.basename(old)[len("cache-"):-len(".bin")])
+        if old_generation < generation - 1:
+            os.remove(old)
+    return path
+
+
+class SharedCache:
+    def __init__(self, directory: str, refresh_seconds: float):
+        self.directory = directory
+        self.refresh_seconds = refresh_seconds
+        self.snapshot: Optional[CacheSnapshot] = None
+        self._attached: Optional[str] = None
+        self._lock_fd: Optional[int] = None
+        self._built_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._lock_fd is not None
+
+    def _try_lead(self) -> None:
+        fd = os.open(os.path.join(self.directory, LOCK), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return
+        self._lock_fd = fd
+
+    def _attach(self) -> None:
+        try:
+            target = os.readlink(os.path.join(self.directory, CURRENT))
+        except FileNotFoundError:
+            return
+        if target != self._attached:
+            try:
+                self.snapshot = CacheSnapshot(os.path.join(self.directory, target))
+            except FileNotFoundError:
+                # поколение успели удалить - подхватим следующее на следующем тике
+                return
+            self._attached = target
+
+    async def _build(self) -> None:
+        async with AsyncSessionLocal() as session:
+            buildings = (await session.execute(select(Building.id, Building.latitude, Building.longitude))).all()
+            activities = (await session.execute(select(Activity.id, Activity.parent_id))).all()
+
+        generation = self.snapshot.generation + 1 if self.snapshot else 1
+        write_generation(self.directory, generation, buildings, activities)
+        self._built_at = time.monotonic()
+
+    async def _tick(self) -> None:
+        if not self.is_leader:
+            # лидер умер - его flock освободился
+            self._try_lead()
+        if self.is_leader and (self._built_at is None or time.monotonic() - self._built_at >= self.refresh_seconds):
+            self._attach()
+            await self._build()
+        self._attach()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(min(1.0, self.refresh_seconds))
+            try:
+                await self._tick()
+            except Exception:
+                # кэш - оптимизация: при ошибке живем на прошлом поколении
+                logger.exception("Shared cache refresh failed")
+
+    async def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        # новый воркер сразу цепляется к готовому поколению и стартует теплым
+        self._attach()
+        await self._tick()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+shared_cache = SharedCache(settings.SHARED_CACHE_DIR, settings.SHARED_CACHE_REFRESH_SECONDS)
+
+
+def get_snapshot() -> Optional[CacheSnapshot]:
+    return shared_cache.snapshot if settings.SHARED_CACHE_ENABLED else None
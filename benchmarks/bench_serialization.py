@@ -0,0 +1,80 @@
+"""
+Payload size and serialization time of List[OrganizationRead] responses
+in every negotiated format, with and without compression.
+
+Run: docker-compose exec app env PYTHONPATH=. python benchmarks/bench_serialization.py
+"""
+import argparse
+import time
+from typing import Any, Callable, Dict, List
+
+from app.api.negotiation import COMPRESSORS, ENCODERS
+from app.schemas.all_schemas import OrganizationRead
+
+
+def make_organizations(count: int, buildings: int, activities: int) -> List[Dict[str, Any]]:
+    # как в реальной выдаче: много организаций на здание, категории общие
+    result = []
+    for i in range(count):
+        building_id = i % buildings + 1
+        result.append({
+            "id": i + 1,
+            "name": f"ООО Организация {i}",
+            "building_id": building_id,
+            "building": {
+                "id": building_id,
+                "address": f"г. Москва, ул. Ленина {building_id}",
+                "latitude": 55.75 + building_id / 10000,
+                "longitude": 37.61 + building_id / 10000,
+            },
+            "activities": [
+                {"id": a, "name": f"Категория {a}", "parent_id": None if a <= 3 else a % 3 + 1}
+                for a in (i % activities + 1, (i * 7) % activities + 1)
+            ],
+            "phones": [
+                {"id": i * 2 + 1, "number": "8-800-555-35-35"},
+                {"id": i * 2 + 2, "number": f"2-22-{i % 100:02d}"},
+            ],
+        })
+    return result
+
+
+def timed(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--organizations", type=int, default=1000)
+    parser.add_argument("--buildings", type=int, default=100)
+    parser.add_argument("--activities", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    raw = make_organizations(args.organizations, args.buildings, args.activities)
+    # то, что отдает FastAPI после response_model
+    content = [OrganizationRead.model_validate(org).model_dump(mode="json") for org in raw]
+
+    model_ms = timed(lambda: [OrganizationRead.model_validate(org).model_dump(mode="json") for org in raw], args.repeat)
+    print(f"{args.organizations} organizations, response_model validation: {model_ms:.2f} ms\n")
+
+    header = f"{'format':<40} {'encode ms':>10} {'bytes':>10}"
+    for name in COMPRESSORS:
+        header += f" {name + ' bytes':>12} {name + ' ms':>9}"
+    print(header)
+
+    for media_type, encode in ENCODERS.items():
+        body = encode(content)
+        row = f"{media_type:<40} {timed(lambda: encode(content), args.repeat):>10.2f} {len(body):>10}"
+        for compress in COMPRESSORS.values():
+            row += f" {len(compress(body)):>12} {timed(lambda: compress(body), args.repeat):>9.2f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,20 @@
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from app.api.endpoints import router as api_router
+from app.api.admin import router as admin_router
 from app.db.init_db import init_db
 from app.core.config import settings
+from app.core.admission import admission_metrics
+from app.core.middleware import CancelOnDisconnectMiddleware
+from app.services.shared_cache import shared_cache
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db()
+    if settings.SHARED_CACHE_ENABLED:
+        await shared_cache.start()
     yield
-    pass
+    await shared_cache.stop()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -17,8 +23,16 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+app.add_middleware(CancelOnDisconnectMiddleware)
+
 app.include_router(api_router, prefix="/api/v1")
+app.include_router(admin_router, prefix="/api/v1")
 
 @app.get("/health")
 def health_check():
         return {"status": "ok"}
+
+@app.get("/metrics")
+def metrics():
+    # глубина очереди и счетчики сброшенных запросов
+    return admission_metrics()
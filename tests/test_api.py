@@ -145,3 +145,556 @@ async def test_not_found(client: AsyncClient):
     """
     response = await client.get("/organizations/999999")
     assert response.status_code == 404
+
+async def test_single_flight_coalesces_identical_calls(session: AsyncSession):
+    """
+    Scenario: Thundering herd.
+    Identical concurrent geo searches share one DB computation and one result.
+    """
+    import asyncio
+    from app.services.business import get_organizations_in_radius
+
+    lat, lon = 55.7558, 37.6173
+    b = Building(address="Herd", latitude=lat, longitude=lon)
+    session.add(b)
+    await session.flush()
+    session.add(Organization(name="Herd Org", building_id=b.id))
+    await session.commit()
+
+    # на одной сессии параллельные запросы упали бы - значит запрос в базу был один
+    first, second = await asyncio.gather(
+        get_organizations_in_radius(session, lat, lon, 1),
+        get_organizations_in_radius(session, lat, lon, 1),
+    )
+    assert first is second
+    assert [org.name for org in first] == ["Herd Org"]
+
+async def test_single_flight_propagates_errors():
+    """
+    Scenario: Leader fails.
+    Every waiter receives the same error, and the key is released afterwards.
+    """
+    import asyncio
+    from app.services.business import single_flight, _in_flight
+
+    calls = 0
+
+    @single_flight
+    async def failing(session, value):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise ValueError(value)
+
+    results = await asyncio.gather(failing(None, 1), failing(None, 1), return_exceptions=True)
+    assert calls == 1
+    assert all(isinstance(r, ValueError) for r in results)
+    assert not _in_flight
+
+async def test_rate_limit_per_api_key(client: AsyncClient, monkeypatch):
+    """
+    Scenario: Misbehaving client.
+    Requests above the per-key token bucket get 429 with Retry-After.
+    """
+    from app.core import admission
+
+    # rate = 0 - лимит выключен (по умолчанию)
+    disabled = admission.RateLimiter(rate=0, burst=1)
+    assert [disabled.check("key") for _ in range(3)] == [0.0, 0.0, 0.0]
+
+    monkeypatch.setattr(admission, "rate_limiter", admission.RateLimiter(rate=0.01, burst=1))
+
+    response = await client.get("/organizations/search/name?q=test")
+    assert response.status_code == 200
+
+    response = await client.get("/organizations/search/name?q=test")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+async def test_load_shedding_when_queue_full(client: AsyncClient, monkeypatch):
+    """
+    Scenario: Overload.
+    All DB slots busy and no room in the wait queue -> 503 with Retry-After.
+    """
+    from app.core import admission
+
+    limiter = admission.ConcurrencyLimiter(limit=1, max_queue=0, queue_timeout=1)
+    monkeypatch.setattr(admission, "db_limiter", limiter)
+
+    await limiter.acquire()
+    try:
+        response = await client.get("/organizations/search/name?q=test")
+    finally:
+        limiter.release()
+
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+    assert limiter.shed_total == 1
+
+async def test_coalesced_waiters_do_not_take_db_slots(monkeypatch):
+    """
+    Scenario: Thundering herd under admission control.
+    Only the single-flight leader holds a DB slot, identical waiters are not shed.
+    """
+    import asyncio
+    from fastapi import FastAPI
+    from httpx import ASGITransport
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from sqlalchemy.pool import NullPool
+    from app.api.endpoints import router
+    from app.core import admission
+    from app.core.config import settings
+    from app.db.session import get_db
+
+    limiter = admission.ConcurrencyLimiter(limit=1, max_queue=0, queue_timeout=1)
+    monkeypatch.setattr(admission, "db_limiter", limiter)
+
+    # у каждого запроса своя сессия, как в проде
+    engine = create_async_engine(settings.DATABASE_URL, poolclass=NullPool)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def override_get_db():
+        async with sessions() as session:
+            yield session
+
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_db] = override_get_db
+
+    url = "/organizations/search/geo?lat=55.7558&lon=37.6173&radius=1"
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            ac.headers["X-API-Key"] = settings.API_KEY
+            responses = await asyncio.gather(*[ac.get(url) for _ in range(5)])
+    finally:
+        await engine.dispose()
+
+    assert [r.status_code for r in responses] == [200] * 5
+    assert limiter.shed_total == 0
+    assert limiter.in_flight == 0
+
+async def test_statement_timeout_per_route(session: AsyncSession, client: AsyncClient, monkeypatch):
+    """
+    Scenario: Per-route statement timeout.
+    The route-specific value is applied with SET LOCAL for the request transaction.
+    """
+    from sqlalchemy import text
+    from app.core.config import settings
+
+    monkeypatch.setitem(settings.STATEMENT_TIMEOUTS, "search_organizations_by_name", 1234)
+
+    response = await client.get("/organizations/search/name?q=test")
+    assert response.status_code == 200
+
+    result = await session.execute(text("SHOW statement_timeout"))
+    assert result.scalar_one() == "1234ms"
+
+async def test_statement_timeout_maps_to_504(session: AsyncSession, monkeypatch):
+    """
+    Scenario: Runaway query.
+    A query cancelled by statement_timeout (sqlstate 57014) becomes 504.
+    """
+    from fastapi import Depends, FastAPI
+    from httpx import ASGITransport
+    from sqlalchemy import text
+    from app.api.endpoints import apply_statement_timeout
+    from app.core.config import settings
+    from app.db.session import get_db
+
+    monkeypatch.setitem(settings.STATEMENT_TIMEOUTS, "sleep", 1)
+
+    app = FastAPI()
+
+    @app.get("/sleep", dependencies=[Depends(apply_statement_timeout)])
+    async def sleep(session: AsyncSession = Depends(get_db)):
+        await session.execute(text("SELECT pg_sleep(1)"))
+
+    async def override_get_db():
+        yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.get("/sleep")
+    assert response.status_code == 504
+
+async def test_cancel_on_client_disconnect():
+    """
+    Scenario: Client goes away.
+    On http.disconnect the middleware cancels the request handler.
+    """
+    import asyncio
+    from app.core.middleware import CancelOnDisconnectMiddleware
+
+    cancelled = asyncio.Event()
+
+    async def app(scope, receive, send):
+        await receive()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    messages = [{"type": "http.request", "body": b"", "more_body": False}, {"type": "http.disconnect"}]
+
+    async def receive():
+        message = messages.pop(0)
+        if message["type"] == "http.disconnect":
+            await asyncio.sleep(0.01)
+        return message
+
+    async def send(message):
+        raise AssertionError("nothing should be sent to a disconnected client")
+
+    await asyncio.wait_for(CancelOnDisconnectMiddleware(app)({"type": "http"}, receive, send), 1)
+    assert cancelled.is_set()
+
+async def test_background_tasks_survive_disconnect_after_response():
+    """
+    Scenario: Post-response work.
+    The http.disconnect sent after the response is complete must not cancel BackgroundTasks.
+    """
+    import asyncio
+    from fastapi import BackgroundTasks
+    from httpx import ASGITransport
+    from main import app
+
+    done = asyncio.Event()
+
+    async def background():
+        await asyncio.sleep(0.01)
+        done.set()
+
+    async def with_background(background_tasks: BackgroundTasks):
+        background_tasks.add_task(background)
+        return {"status": "ok"}
+
+    # httpx, как и uvicorn, после ответа отвечает на receive() сообщением http.disconnect
+    app.add_api_route("/_test/background", with_background)
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            response = await ac.get("/_test/background")
+    finally:
+        app.router.routes.pop()
+
+    assert response.status_code == 200
+    assert done.is_set()
+
+async def test_content_negotiation(session: AsyncSession, client: AsyncClient):
+    """
+    Scenario: Compact formats.
+    MessagePack and dictionary-encoded JSON carry the same data as plain JSON.
+    """
+    import msgpack
+    from app.models.orm import OrganizationPhone
+
+    b = Building(address="Format St", latitude=10, longitude=10)
+    session.add(b)
+    await session.flush()
+    activity = Activity(name="Format Activity")
+    session.add(activity)
+    await session.flush()
+    org = Organization(name="Format Org 1", building_id=b.id, activities=[activity])
+    session.add_all([org, Organization(name="Format Org 2", building_id=b.id)])
+    await session.flush()
+    session.add(OrganizationPhone(number="1-11-11", organization_id=org.id))
+    await session.commit()
+
+    url = f"/buildings/{b.id}/organizations"
+    plain = (await client.get(url)).json()
+
+    response = await client.get(url, headers={"Accept": "application/msgpack"})
+    assert response.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(response.content) == plain
+
+    response = await client.get(url, headers={"Accept": "application/vnd.directory.dict+json"})
+    data = response.json()
+    assert data["buildings"]["id"] == [b.id]
+    assert data["organizations"]["building_id"] == [b.id, b.id]
+
+    # обратно из колонок в OrganizationRead - ровно тот же json
+    def rows(table):
+        return [dict(zip(table, values)) for values in zip(*table.values())]
+
+    buildings = {row["id"]: row for row in rows(data["buildings"])}
+    activities = {row["id"]: row for row in rows(data["activities"])}
+    decoded = [
+        {
+            "id": org["id"],
+            "name": org["name"],
+            "building_id": org["building_id"],
+            "building": buildings[org["building_id"]],
+            "activities": [activities[activity_id] for activity_id in org["activity_ids"]],
+            "phones": [{"id": i, "number": n} for i, n in zip(org["phone_ids"], org["phones"])],
+        }
+        for org in rows(data["organizations"])
+    ]
+    assert decoded == plain
+
+    # у зданий словарного формата нет - обычный json с честным content-type
+    response = await client.get("/buildings/", headers={"Accept": "application/vnd.directory.dict+json"})
+    assert response.headers["content-type"] == "application/json"
+    assert isinstance(response.json(), list)
+
+async def test_compression_threshold(client: AsyncClient, monkeypatch):
+    """
+    Scenario: Compression negotiation.
+    Bodies above COMPRESSION_MIN_SIZE are gzip-compressed, smaller ones are not.
+    """
+    from app.core.config import settings
+
+    response = await client.get("/buildings/", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+
+    monkeypatch.setattr(settings, "COMPRESSION_MIN_SIZE", 0)
+    response = await client.get("/buildings/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == []
+
+async def test_export_copy_csv(session: AsyncSession):
+    """
+    Scenario: Bulk export.
+    COPY TO STDOUT streams a CSV with header, one row per organization in flat mode.
+    """
+    from app.services.export import ExportTable, stream_copy
+
+    b = Building(address="Export St", latitude=1, longitude=2)
+    session.add(b)
+    await session.flush()
+    session.add(Organization(name="Export Org", building_id=b.id))
+    await session.commit()
+
+    connection = await session.connection()
+    body = b"".join([chunk async for chunk in stream_copy(connection, ExportTable.organizations_flat)])
+    lines = body.decode().splitlines()
+
+    assert lines[0] == "id,name,building_id,address,latitude,longitude,activities,phones"
+    assert lines[1].split(",")[1:4] == ["Export Org", str(b.id), "Export St"]
+
+async def test_export_closed_midway_releases_connection(monkeypatch):
+    """
+    Scenario: Client disconnects during export.
+    Closing the stream waits for the cancelled COPY, so the connection is usable again.
+    """
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import NullPool
+    from app.core.config import settings
+    from app.services import export
+    from app.services.export import ExportTable, stream_copy
+
+    # маленький буфер - COPY гарантированно еще идет, когда поток закрывают
+    monkeypatch.setattr(export, "EXPORT_BUFFER_CHUNKS", 1)
+    engine = create_async_engine(settings.DATABASE_URL, poolclass=NullPool)
+    try:
+        async with engine.connect() as connection:
+            await connection.execute(text(
+                "INSERT INTO buildings (address, latitude, longitude) "
+                "SELECT 'Bulk ' || i, 0, 0 FROM generate_series(1, 50000) AS i"
+            ))
+
+            stream = stream_copy(connection, ExportTable.buildings)
+            assert (await stream.__anext__()).startswith(b"id,address")
+            await stream.aclose()
+
+            # COPY еще шел бы - asyncpg ответил бы "another operation is in progress"
+            await connection.rollback()
+            result = await connection.execute(text("SELECT 1"))
+            assert result.scalar_one() == 1
+    finally:
+        await engine.dispose()
+
+async def test_read_model_maintained_by_triggers(session: AsyncSession, client: AsyncClient, monkeypatch):
+    """
+    Scenario: Denormalized read model.
+    Triggers keep one row per organization with ancestor activity ids,
+    and endpoints serve the same DTO from it.
+    """
+    from sqlalchemy import select
+    from app.core.config import settings
+    from app.models.orm import OrganizationPhone, OrganizationReadModel
+
+    root = Activity(name="RM Root")
+    session.add(root)
+    await session.flush()
+    child = Activity(name="RM Child", parent_id=root.id)
+    session.add(child)
+    await session.flush()
+
+    b = Building(address="Read St", latitude=20, longitude=20)
+    session.add(b)
+    await session.flush()
+
+    org = Organization(name="Read Org", building_id=b.id, activities=[child])
+    session.add(org)
+    await session.flush()
+    session.add(OrganizationPhone(number="1-23-45", organization_id=org.id))
+    await session.commit()
+
+    row = (await session.execute(
+        select(OrganizationReadModel).where(OrganizationReadModel.organization_id == org.id)
+    )).scalar_one()
+    assert sorted(row.activity_ancestor_ids) == sorted([root.id, child.id])
+    assert [p["number"] for p in row.document["phones"]] == ["1-23-45"]
+
+    expected = (await client.get(f"/organizations/{org.id}")).json()
+
+    monkeypatch.setattr(settings, "READ_MODEL_ENABLED", True)
+    response = await client.get(f"/activities/{root.id}/organizations")
+    assert response.status_code == 200
+    assert response.json() == [expected]
+
+    response = await client.get("/activities/999999/organizations")
+    assert response.status_code == 404
+
+async def test_profile_request_with_explain(session: AsyncSession, monkeypatch, tmp_path):
+    """
+    Scenario: On-demand profiling.
+    X-Profile with the admin key stores a report with EXPLAIN ANALYZE plans,
+    collected in a background task after the response. Goes through main.app,
+    so the disconnect middleware and the admin router are in the stack.
+    """
+    from httpx import ASGITransport
+    from main import app
+    from app.core.config import settings
+    from app.core.profiling import profile_store
+    from app.db.session import get_db
+
+    monkeypatch.setattr(settings, "ADMIN_API_KEY", "admin-key")
+    # отчеты лежат в общем для воркеров каталоге
+    monkeypatch.setattr(profile_store, "directory", str(tmp_path))
+
+    async def override_get_db():
+        yield session
+
+    monkeypatch.setitem(app.dependency_overrides, get_db, override_get_db)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        ac.headers["X-API-Key"] = settings.API_KEY
+        url = "/api/v1/organizations/search/name?q=test"
+
+        response = await ac.get(url, headers={"X-Profile": "1"})
+        assert "X-Profile-Id" not in response.headers
+
+        response = await ac.get(url, headers={"X-Profile": "1", "X-Admin-Key": "admin-key"})
+        assert response.status_code == 200
+        profile_id = response.headers["X-Profile-Id"]
+
+        response = await ac.get(f"/api/v1/admin/profiles/{profile_id}", headers={"X-Admin-Key": "admin-key"})
+        assert response.status_code == 200
+        report = response.json()
+
+    assert report["explain"] == "done"
+    assert report["path"] == "/api/v1/organizations/search/name"
+    assert report["python_scope"] == "process"
+    selects = [s for s in report["sql"] if s["statement"].lstrip().upper().startswith("SELECT")]
+    assert selects
+    assert "Plan" in selects[0]["plan"][0]
+
+async def test_shared_cache_snapshot(tmp_path):
+    """
+    Scenario: Shared-memory cache.
+    A generation written by the leader is attached read-only and answers
+    radius and activity subtree lookups like the SQL versions.
+    """
+    import os
+    from app.services.shared_cache import CacheSnapshot, SharedCache, write_generation
+
+    buildings = [(1, 55.7558, 37.6173), (2, 55.751244, 37.618423), (3, 10.0, 10.0)]
+    activities = [(1, None), (2, 1), (3, 2), (4, None)]
+    write_generation(str(tmp_path), 1, buildings, activities)
+
+    snapshot = CacheSnapshot(os.path.join(tmp_path, "cache-1.bin"))
+    assert sorted(snapshot.building_ids_in_radius(55.7558, 37.6173, 1, max_scan=10)) == [1, 2]
+    # полоса шире max_scan - None, считать будет sql
+    assert snapshot.building_ids_in_radius(55.7558, 37.6173, 1, max_scan=1) is None
+    assert sorted(snapshot.activity_subtree_ids(1)) == [1, 2, 3]
+    assert snapshot.activity_subtree_ids(999) == []
+
+    # новое поколение подхватывается атомарной сменой симлинка
+    write_generation(str(tmp_path), 2, buildings[:1], activities)
+    worker = SharedCache(str(tmp_path), 60)
+    worker._attach()
+    assert worker.snapshot.generation == 2
+    assert list(worker.snapshot.building_ids) == [1]
+
+async def test_suggest_prefix_normalized(session: AsyncSession, client: AsyncClient):
+    """
+    Scenario: Autocomplete.
+    Prefix search ignores case and diacritics (ё/е, й/и) and returns only id and name.
+    """
+    from sqlalchemy import text, update
+
+    b = Building(address="Suggest St", latitude=30, longitude=30)
+    session.add(b)
+    await session.flush()
+    session.add_all([
+        Organization(name="Ёлочка", building_id=b.id),
+        Organization(name="Елисеевский", building_id=b.id),
+        Organization(name="Молочный Мир", building_id=b.id),
+    ])
+    await session.commit()
+
+    response = await client.get("/organizations/suggest?prefix=ЕЛ")
+    assert response.status_code == 200
+    assert [o["name"] for o in response.json()] == ["Елисеевский", "Ёлочка"]
+    assert set(response.json()[0]) == {"id", "name"}
+
+    response = await client.get("/organizations/suggest?prefix=ёло&limit=1")
+    assert [o["name"] for o in response.json()] == ["Ёлочка"]
+
+    response = await client.get("/organizations/suggest?prefix=мол")
+    assert [o["name"] for o in response.json()] == ["Молочный Мир"]
+
+    # колонку считает база: сырой SQL и bulk update() видны сразу, старое имя не подсказывается
+    await session.execute(
+        text("INSERT INTO organizations (name, building_id) VALUES ('Йогуртерия', :b)"), {"b": b.id}
+    )
+    await session.execute(update(Organization).where(Organization.name == "Молочный Мир").values(name="Сырный Мир"))
+    await session.commit()
+
+    response = await client.get("/organizations/suggest?prefix=ио")
+    assert [o["name"] for o in response.json()] == ["Йогуртерия"]
+    response = await client.get("/organizations/suggest?prefix=мол")
+    assert response.json() == []
+    response = await client.get("/organizations/suggest?prefix=сыр")
+    assert [o["name"] for o in response.json()] == ["Сырный Мир"]
+
+async def test_reverse_phone_lookup(session: AsyncSession, client: AsyncClient):
+    """
+    Scenario: Caller ID.
+    Input is normalized to digits; exact and suffix matching find the owner.
+    """
+    from app.models.orm import OrganizationPhone
+
+    b = Building(address="Phone St", latitude=40, longitude=40)
+    session.add(b)
+    await session.flush()
+    org = Organization(name="Phone Org", building_id=b.id)
+    session.add(org)
+    await session.flush()
+    session.add(OrganizationPhone(number="8-800-555-35-35", organization_id=org.id))
+    await session.commit()
+
+    response = await client.get("/organizations/by-phone", params={"number": "8 (800) 555 35 35"})
+    assert response.status_code == 200
+    assert [o["name"] for o in response.json()] == ["Phone Org"]
+
+    response = await client.get("/organizations/by-phone", params={"number": "+7 800 555-35-35"})
+    assert response.json() == []
+
+    response = await client.get("/organizations/by-phone", params={"number": "555-35-35", "match": "suffix"})
+    assert [o["name"] for o in response.json()] == ["Phone Org"]
+
+    response = await client.get("/organizations/by-phone", params={"number": "35", "match": "suffix"})
+    assert response.status_code == 400
+
+    # generated column: номер, вставленный мимо ORM, тоже находится
+    from sqlalchemy import text
+    await session.execute(
+        text("INSERT INTO organization_phones (number, organization_id) VALUES ('+7 (495) 123-45-67', :org_id)"),
+        {"org_id": org.id},
+    )
+    response = await client.get("/organizations/by-phone", params={"number": "74951234567"})
+    assert [o["name"] for o in response.json()] == ["Phone Org"]